@@ -1,42 +1,78 @@
 import os
-import io
 import re
+import sys
+import argparse
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import requests
 import json
+import pathlib
 import collections
+import zipfile
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    from python_calamine import CalamineError
+    HAS_CALAMINE = True
+except ImportError:
+    CalamineError = ValueError
+    HAS_CALAMINE = False
 
 # ================= 配置区域 =================
 INPUT_DIR = "input"       # 放入每天下载的 xls 文件的目录
 OUTPUT_DIR = "output"     # 结果保存目录
 ETF_PATH = os.path.join("config", "科创债名单.xlsx")  # 您的名单模板路径
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "科创债ETF_累计结果.xlsx")
+RESULT_STORE = os.path.join(OUTPUT_DIR, "cumulative.parquet")  # 累计结果的主存储，xlsx 仅为导出
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "processed_files.json")  # 每个日期已处理的输入文件指纹
+LUT_SIZE = 1_000_000      # 证券代码为 6 位整数，查找表按代码直接寻址
+MAX_READ_WORKERS = 8      # 并行读取文件的最大进程数
+CACHE_DIR = "cache"       # 已解析输入文件的 parquet 缓存目录
+TEMPLATE_CACHE_PREFIX = "template-"  # 名单模板缓存文件名前缀，后接模板路径与内容指纹
 # 请替换为您的真实飞书 Webhook
 WEBHOOK_URL = "https://open.feishu.cn/open-apis/bot/v2/hook/fc7e6de2-fa45-4c14-96ac-c7bda5874732"
 # ===========================================
 
-def load_push_config():
+FIXED_COLS = ["基金代码", "基金简称"]
+INVALID_CODE = -1  # 基金代码不是数字时的占位值，查找时视为无数据，保存时还原为空
+DATE_LABEL_FORMAT = "%Y/%m/%d"  # 日期列在 parquet / xlsx 中的列名格式
+
+_DATE_RE = re.compile(r"(\d{8})")
+_SESSION = requests.Session()  # 复用连接，多次推送时省去重复的 TCP/TLS 握手
+
+def load_config():
+    """
+    读取 config.json，返回配置字典：
+    push_enabled   是否推送飞书
+    force_reparse  是否强制重新处理所有日期（默认只处理输入文件有变化的日期）
+    """
+    cfg = {"push_enabled": False, "force_reparse": False}
     cfg_path = "config.json"
     if not os.path.exists(cfg_path):
-        return False
+        return cfg
     try:
-        with open(cfg_path, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
-            return cfg.get("push_enabled", False)
-    except:
-        return False
+        data = pathlib.Path(cfg_path).read_bytes()
+        cfg.update(json_loads(data) if data else {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 读取 {cfg_path} 失败，使用默认配置: {e}")
+    return cfg
 
-def extract_date_from_filename(filename: str) -> str:
+def parse_date(date_str: str) -> pd.Timestamp:
     """
-    从文件名中提取8位数字日期，例如 20251124 -> 2025/11/24
+    YYYYMMDD -> Timestamp，不是合法日期时返回 None
     """
-    basename = os.path.basename(filename)
-    m = re.search(r"(\d{8})", basename)
-    if not m:
+    try:
+        return pd.Timestamp(year=int(date_str[0:4]), month=int(date_str[4:6]), day=int(date_str[6:8]))
+    except ValueError:
         return None
-    date_str = m.group(1)
-    return f"{date_str[0:4]}/{date_str[4:6]}/{date_str[6:8]}"
 
 def group_files_by_date():
     """
@@ -49,27 +85,205 @@ def group_files_by_date():
         print(f"⚠️ 目录 {INPUT_DIR} 不存在，已自动创建，请放入 xls 文件。")
         return {}
 
-    raw_files = [f for f in os.listdir(INPUT_DIR) if f.lower().endswith((".xls", ".xlsx", ".csv"))]
+    # 一次遍历完成：过滤扩展名 + 从文件名提取8位日期 + 分组
+    has_excel = False
+    with os.scandir(INPUT_DIR) as it:
+        for entry in it:
+            if not entry.is_file() or not entry.name.lower().endswith((".xls", ".xlsx", ".csv")):
+                continue
+            has_excel = True
+            m = _DATE_RE.search(entry.name)
+            if m:
+                files_map[m.group(1)].append(entry.path)
     
-    if not raw_files:
+    if not has_excel:
         print("⚠️ input 目录没有任何 Excel 文件")
         return {}
 
-    for f in raw_files:
-        date_str = extract_date_from_filename(f)
-        if date_str:
-            full_path = os.path.join(INPUT_DIR, f)
-            files_map[date_str].append(full_path)
-
-    # 按日期排序
-    sorted_dates = sorted(files_map.keys())
-    print(f"✅ 扫描到 {len(sorted_dates)} 个日期的文件待处理")
+    # 按日期排序：YYYYMMDD 原始字符串的字典序即时间顺序，最后再转换为 Timestamp
+    result = {}
+    for date_str, paths in sorted(files_map.items()):
+        date = parse_date(date_str)
+        if date is None:
+            print(f"⚠️ 无效日期 {date_str}，已跳过: {paths}")
+            continue
+        result[date] = paths
+    print(f"✅ 扫描到 {len(result)} 个日期的文件待处理")
     
-    return {date: files_map[date] for date in sorted_dates}
+    return result
+
+def find_code_rate_columns(headers):
+    """
+    根据表头定位 代码 / 折算率 两列的位置，找不到时退回第1列和第3列
+    """
+    idx_code = next((i for i, h in enumerate(headers) if h and '代码' in str(h)), None)
+    idx_rate = next((i for i, h in enumerate(headers) if h and '折算' in str(h)), None)
+
+    if idx_code is None or idx_rate is None:
+        idx_code = 0
+        idx_rate = 2 if len(headers) > 2 else 1
+    return idx_code, idx_rate
+
+def read_xlsx_readonly(file_path, header_row, multiplier):
+    """
+    calamine 不可用时的 xlsx 读取方式：
+    openpyxl read_only 流式逐行读取，不构建整张表的 DOM，也不经过 DataFrame
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(min_row=header_row + 1, values_only=True)
+        headers = next(rows, ())
+        idx_code, idx_rate = find_code_rate_columns(headers)
+
+        codes, rates = [], []
+        for row in rows:
+            if len(row) <= max(idx_code, idx_rate):
+                continue
+            try:
+                code = int(float(row[idx_code]))
+                rate = int(round(float(row[idx_rate]) * multiplier))
+            except (TypeError, ValueError):
+                continue
+            codes.append(code)
+            rates.append(rate)
+        return np.array(codes, dtype=np.int64), np.array(rates, dtype=np.int64)
+    finally:
+        wb.close()
+
+def read_csv_any_encoding(file_path, **kwargs):
+    """
+    先按 gbk 读取，失败再按 utf-8 读取
+    """
+    try:
+        return pd.read_csv(file_path, encoding="gbk", **kwargs)
+    except UnicodeDecodeError:
+        return pd.read_csv(file_path, encoding="utf-8", **kwargs)
+
+def read_table(file_path, header_row, **kwargs):
+    """
+    按扩展名读取表格：csv 走 C 引擎，xls/xlsx 走 calamine（同时支持两种格式，直接传路径）
+    部分下载的 xls 实际是文本表格，Excel 解析失败时再按分隔符自动识别兜底
+    """
+    if os.path.splitext(file_path)[1].lower() == ".csv":
+        return read_csv_any_encoding(file_path, header=header_row, **kwargs)
+
+    engine = "calamine" if HAS_CALAMINE else None
+    try:
+        return pd.read_excel(file_path, header=header_row, engine=engine, **kwargs)
+    except (ValueError, OSError, CalamineError):
+        return read_csv_any_encoding(file_path, header=header_row, sep=None, engine="python", **kwargs)
+
+@functools.lru_cache(maxsize=None)
+def file_digest(file_path, mtime_ns, size):
+    """
+    文件内容的 sha1；mtime / size 只作为本进程内的记忆键，不进入指纹
+    """
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_fingerprint(file_path):
+    """
+    文件指纹：文件名 + 大小 + 内容 sha1，只随文件内容变化
+    （CI 检出的文件修改时间每次都是新的，不能用 mtime）
+    """
+    st = os.stat(file_path)
+    return f"{os.path.basename(file_path)}-{st.st_size}-{file_digest(file_path, st.st_mtime_ns, st.st_size)}"
+
+def get_cache_path(file_path):
+    """
+    缓存文件名由文件内容指纹组成，源文件内容变化后自动失效，
+    与修改时间无关（CI 中由 actions/cache 恢复 cache/ 后仍可命中）
+    """
+    return os.path.join(CACHE_DIR, file_fingerprint(file_path) + ".parquet")
+
+def load_manifest():
+    """
+    读取 {日期: [文件指纹, ...]}，记录每个日期上次处理时用到的输入文件
+    """
+    try:
+        return json_loads(pathlib.Path(MANIFEST_FILE).read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def get_template_cache_path(etf_path):
+    """
+    名单模板缓存路径：模板路径的哈希 + 内容指纹，
+    换了模板文件或改用根目录下的名单时都不会命中旧缓存
+    """
+    path_key = hashlib.sha1(os.path.normpath(etf_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{TEMPLATE_CACHE_PREFIX}{path_key}-{file_fingerprint(etf_path)}.parquet")
+
+def prune_file_cache(file_paths, etf_path):
+    """
+    删除不再对应任何现有输入文件或当前名单模板的缓存
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+    valid = {os.path.basename(get_cache_path(p)) for p in file_paths}
+    valid.add(os.path.basename(get_template_cache_path(etf_path)))
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".parquet") and name not in valid:
+            os.remove(os.path.join(CACHE_DIR, name))
+
+def read_all_files(file_paths):
+    """
+    多进程并行读取所有文件，返回 {文件路径: (代码数组, 折算率数组)}
+    读取失败的文件只打印错误，不影响其他文件
+    """
+    parsed = {}
+    max_workers = min(MAX_READ_WORKERS, os.cpu_count() or 1, len(file_paths))
+
+    # 只有一个文件或单核时，开进程池的开销大于收益，直接在当前进程读取
+    if max_workers <= 1:
+        for file_path in file_paths:
+            try:
+                _, parsed[file_path] = read_file_data(file_path)
+            except Exception as e:
+                print(f"❌ 读取文件失败 {os.path.basename(file_path)}: {e}")
+        return parsed
+
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(read_file_data, p): p for p in file_paths}
+        for fut in as_completed(futures):
+            try:
+                _, parsed[futures[fut]] = fut.result()
+            except Exception as e:
+                print(f"❌ 读取文件失败 {os.path.basename(futures[fut])}: {e}")
+    return parsed
 
 def read_file_data(file_path):
     """
-    读取单个文件，返回 {代码: 折算率} 的字典
+    读取单个文件，返回 (文件路径, (代码数组, 折算率数组))，两个数组均为 int64
+    优先读取 parquet 缓存，未命中时解析原文件并写入缓存
+    """
+    cache_path = get_cache_path(file_path)
+    if os.path.exists(cache_path):
+        print(f"   → 读取缓存: {os.path.basename(file_path)}")
+        df = pd.read_parquet(cache_path)
+        return file_path, (df["code"].to_numpy(np.int64), df["rate"].to_numpy(np.int64))
+
+    codes, rates = parse_file_data(file_path)
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        pd.DataFrame({"code": codes, "rate": rates}).to_parquet(cache_path, compression="zstd", index=False)
+    except (ImportError, OSError) as e:
+        print(f"     ⚠️ 写入缓存失败: {e}")
+
+    return file_path, (codes, rates)
+
+def parse_file_data(file_path):
+    """
+    解析单个文件，返回 (代码数组, 折算率数组)，无折算率的行会被丢弃
     自动判断是上海还是深圳格式，并统一单位为整数
     """
     filename = os.path.basename(file_path)
@@ -81,65 +295,159 @@ def read_file_data(file_path):
         header_row = 2
         print(f"   → 读取上海文件 (Header=3): {filename}")
 
-    with open(file_path, "rb") as f:
-        file_stream = io.BytesIO(f.read())
+    if not HAS_CALAMINE and file_path.lower().endswith(".xlsx"):
+        from openpyxl.utils.exceptions import InvalidFileException
 
-    try:
-        df = pd.read_excel(file_stream, header=header_row)
-    except:
-        file_stream.seek(0)
+        multiplier = 100 if "深圳" in filename else 1
         try:
-            df = pd.read_csv(file_stream, header=header_row, sep=None, engine="python", encoding='gbk')
-        except:
-            df = pd.read_csv(file_stream, header=header_row, sep=None, engine="python", encoding='utf-8')
-
-    cols = df.columns.tolist()
-    col_code = next((c for c in cols if '代码' in str(c)), None)
-    col_rate = next((c for c in cols if '折算' in str(c)), None)
-
-    if not col_code or not col_rate:
-        col_code = cols[0]
-        col_rate = cols[2] if len(cols) > 2 else cols[1]
-
-    df = df.dropna(subset=[col_code])
-    df[col_code] = pd.to_numeric(df[col_code], errors="coerce")
-    df = df.dropna(subset=[col_code])
-    df[col_code] = df[col_code].astype("Int64")
-    df[col_rate] = pd.to_numeric(df[col_rate], errors="coerce")
+            codes, rates = read_xlsx_readonly(file_path, header_row, multiplier)
+            if multiplier != 1:
+                print(f"     ⚡️ 检测到深圳数据，执行 x100 修正")
+            return codes, rates
+        except (InvalidFileException, zipfile.BadZipFile):
+            # 扩展名是 xlsx 但实际不是 xlsx 工作簿，交给下面的 pandas 通用路径
+            pass
+
+    # 先只读表头定位两列，再用 usecols 只解析这两列
+    cols = read_table(file_path, header_row, nrows=0).columns
+    idx_code, idx_rate = find_code_rate_columns(cols)
+    df = read_table(file_path, header_row, usecols=[idx_code, idx_rate])
+
+    col_code = cols[idx_code]
+    col_rate = cols[idx_rate]
+
+    # 两列各转换一次为 float 数组，非数字记为 NaN，再用一个掩码同时过滤
+    codes = pd.to_numeric(df[col_code], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    rates = pd.to_numeric(df[col_rate], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
     
     if "深圳" in filename:
         print(f"     ⚡️ 检测到深圳数据，执行 x100 修正")
-        df[col_rate] = df[col_rate] * 100
-    
-    df[col_rate] = df[col_rate].round(0).astype("Int64")
+        rates = rates * 100
     
-    return dict(zip(df[col_code], df[col_rate]))
+    mask = ~np.isnan(codes) & ~np.isnan(rates)
+    return codes[mask].astype(np.int64), np.round(rates[mask]).astype(np.int64)
 
-def process_date_group(date_str, file_list, df_result):
-    print(f"📅 开始处理日期: {date_str}")
-    combined_map = {}
-    
+def process_date_group(date, file_list, parsed, result_codes):
+    """
+    合并同一日期下所有文件的数据，返回与 result_codes 对齐的 Int64 折算率数组
+    parsed 为 read_all_files 的结果，result_codes 为结果表的 int64 基金代码数组
+    """
+    print(f"📅 开始处理日期: {date.strftime(DATE_LABEL_FORMAT)}")
+
+    # 以代码为下标的查找表，-1 表示无数据；按文件顺序写入，同一代码以后读到的为准
+    lut = np.full(LUT_SIZE, -1, dtype=np.int64)
     for file_path in file_list:
-        try:
-            file_map = read_file_data(file_path)
-            combined_map.update(file_map)
-        except Exception as e:
-            print(f"❌ 读取文件失败 {os.path.basename(file_path)}: {e}")
+        if file_path in parsed:
+            codes, rates = parsed[file_path]
+            mask = (codes >= 0) & (codes < LUT_SIZE)
+            lut[codes[mask]] = rates[mask]
 
-    df_result["基金代码"] = pd.to_numeric(df_result["基金代码"], errors="coerce").astype("Int64")
-    df_result[date_str] = df_result["基金代码"].map(combined_map)
-    return df_result
+    in_range = (result_codes >= 0) & (result_codes < LUT_SIZE)
+    values = np.where(in_range, lut[np.where(in_range, result_codes, 0)], -1)
+    return pd.arrays.IntegerArray(values, values == -1)
+
+def load_template(etf_path):
+    """
+    读取科创债名单模板，按模板路径与内容指纹缓存为 parquet，
+    模板内容未变化时直接读取缓存
+    """
+    cache_path = get_template_cache_path(etf_path)
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df_template = pd.read_excel(etf_path)[FIXED_COLS]
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df_template.to_parquet(cache_path, index=False)
+    except (ImportError, OSError) as e:
+        print(f"⚠️ 写入模板缓存失败: {e}")
+    return df_template
+
+def load_or_init_result(df_template):
+    """
+    加载累计结果：优先读取 parquet 主存储，
+    没有时兼容读取旧的 xlsx 结果，都没有则从名单模板初始化
+    """
+    if os.path.exists(RESULT_STORE):
+        print(f"✅ 加载历史文件: {RESULT_STORE}")
+        df = labels_to_dates(pd.read_parquet(RESULT_STORE))
+    elif os.path.exists(OUTPUT_FILE):
+        print(f"✅ 加载历史文件: {OUTPUT_FILE}")
+        df = labels_to_dates(pd.read_excel(OUTPUT_FILE))
+    else:
+        print("✅ 初始化新文件")
+        return df_template.copy()
+
+    # 旧 xlsx 读入的日期列为 float64 / int64，统一为与新日期列相同的 Int64
+    for c in get_date_columns(df):
+        df[c] = pd.to_numeric(df[c], errors="coerce").round().astype("Int64")
+    return df
+
+def labels_to_dates(df):
+    """
+    日期列名 'YYYY/MM/DD' -> Timestamp（读取历史结果后调用），
+    无法解析的列名（如手工加的 备注、Unnamed: n）原样保留并提示
+    """
+    mapping = {}
+    for c in df.columns:
+        if c in FIXED_COLS:
+            continue
+        d = pd.to_datetime(c, format=DATE_LABEL_FORMAT, errors="coerce")
+        if pd.isna(d):
+            print(f"⚠️ 历史结果中的列 {c!r} 不是日期，原样保留")
+        else:
+            mapping[c] = d
+    return df.rename(columns=mapping)
+
+def prepare_output(df):
+    """
+    写 parquet / xlsx 前的转换：日期列名转为字符串，占位基金代码还原为空值
+    """
+    df = dates_to_labels(df)
+    codes = df["基金代码"]
+    df["基金代码"] = codes.astype("Int64").mask(codes == INVALID_CODE)
+    return df
+
+def dates_to_labels(df):
+    """
+    日期列名 Timestamp -> 'YYYY/MM/DD'（写 parquet / xlsx 前调用，parquet 只支持字符串列名）
+    """
+    return df.rename(columns=lambda c: c.strftime(DATE_LABEL_FORMAT) if isinstance(c, pd.Timestamp) else c)
+
+def export_excel(df, path):
+    """
+    用 xlsxwriter constant_memory 模式流式写出 xlsx，逐行落盘，不在内存中缓存整张表
+    注意：该模式要求按行顺序写入，pandas 的 to_excel 是按列写的，所以这里手动逐行写
+    """
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        ws = wb.add_worksheet()
+        ws.write_row(0, 0, [str(c) for c in df.columns])
+        values = df.astype(object).where(df.notna(), None)
+        for i, row in enumerate(values.itertuples(index=False, name=None), start=1):
+            ws.write_row(i, 0, row)
+    finally:
+        wb.close()
+
+def get_date_columns(df):
+    """
+    取出所有日期列（列名为 Timestamp 的列）
+    """
+    return [c for c in df.columns if isinstance(c, pd.Timestamp)]
 
 def sort_columns(df):
     """
     列排序：
     1. 固定列在左
-    2. 日期列按【从新到旧】排序 (reverse=True)
+    2. 日期列按【从新到旧】排序 (ascending=False)
+    3. 其他非日期列保持原顺序放在最右
     """
-    fixed_cols = ["基金代码", "基金简称"]
-    # 找出日期列，并倒序排列（最近的日期在最左边）
-    date_cols = sorted([c for c in df.columns if c not in fixed_cols], reverse=True)
-    return df[fixed_cols + date_cols]
+    # 日期列为 Timestamp，直接倒序排列（最近的日期在最左边）
+    date_cols = sorted(get_date_columns(df), reverse=True)
+    other_cols = [c for c in df.columns if c not in FIXED_COLS and not isinstance(c, pd.Timestamp)]
+    return df[FIXED_COLS + date_cols + other_cols]
 
 def send_to_feishu(file_name, title_text, content_text):
     """
@@ -169,82 +477,123 @@ def send_to_feishu(file_name, title_text, content_text):
     }
 
     try:
-        resp = requests.post(WEBHOOK_URL, data=json.dumps(data), headers={"Content-Type": "application/json"})
+        resp = _SESSION.post(WEBHOOK_URL, json=data, timeout=5)
         print("✅ 飞书推送结果:", resp.text)
     except Exception as e:
         print("❌ 飞书推送失败:", e)
 
 if __name__ == "__main__":
-    push_enabled = load_push_config()
+    parser = argparse.ArgumentParser(description="科创债ETF折算率累计处理")
+    parser.add_argument("--force", action="store_true", help="即使输入文件未变化，也重新处理所有日期")
+    args = parser.parse_args()
+
+    config = load_config()
+    push_enabled = config["push_enabled"]
+    force_reparse = args.force or config["force_reparse"]
+
+    # 先扫描 input，没有待处理文件时直接结束，不读取名单模板和历史结果
+    grouped_files = group_files_by_date()
+    if not grouped_files:
+        print("⚠️ 没有需要处理的文件，脚本结束")
+        sys.exit(0)
 
     if not os.path.exists(ETF_PATH):
         if os.path.exists("科创债名单.xlsx"):
              ETF_PATH = "科创债名单.xlsx"
         else:
              raise FileNotFoundError(f"❌ 找不到配置文件: {ETF_PATH}")
-    
-    df_template = pd.read_excel(ETF_PATH)[["基金代码", "基金简称"]]
 
-    if os.path.exists(OUTPUT_FILE):
-        print(f"✅ 加载历史文件: {OUTPUT_FILE}")
-        df_result = pd.read_excel(OUTPUT_FILE)
-    else:
-        print("✅ 初始化新文件")
-        df_result = df_template.copy()
+    all_files = [p for files in grouped_files.values() for p in files]
+    prune_file_cache(all_files, ETF_PATH)
 
-    grouped_files = group_files_by_date()
+    df_template = load_template(ETF_PATH)
+
+    df_result = load_or_init_result(df_template)
+
+    # 基金代码统一为 int64，只做一次；不是数字的代码保留该行，用占位值代替
+    codes = pd.to_numeric(df_result["基金代码"], errors="coerce")
+    if codes.isna().any():
+        invalid = df_result.loc[codes.isna(), "基金简称"].tolist()
+        print(f"⚠️ {len(invalid)} 行基金代码不是数字，该行不会匹配到折算率: {invalid}")
+    df_result["基金代码"] = codes.fillna(INVALID_CODE).astype(np.int64)
+
+    # 某日期的输入文件与上次处理时完全一致（文件名、修改时间、大小）才跳过；
+    # 同一天后到的文件（如下午才下载的深圳文件）或被更正的文件会让该日期重新处理
+    manifest = load_manifest()
+    if not force_reparse:
+        done = {
+            d for d, files in grouped_files.items()
+            if d in df_result.columns
+            and manifest.get(d.strftime(DATE_LABEL_FORMAT)) == sorted(file_fingerprint(p) for p in files)
+        }
+        if done:
+            print(f"⏭️ 跳过 {len(done)} 个输入文件未变化的日期（如需重新处理请加 --force 或设置 force_reparse）")
+        grouped_files = {d: files for d, files in grouped_files.items() if d not in done}
+
+    parsed = read_all_files([p for files in grouped_files.values() for p in files])
+    result_codes = df_result["基金代码"].to_numpy()
+    date_columns = {date: process_date_group(date, files, parsed, result_codes) for date, files in grouped_files.items()}
+
+    if date_columns:
+        # 所有日期拼成一个块，一次拼接到结果表（已存在的同名日期列先删除）
+        new_block = pd.DataFrame(date_columns, index=df_result.index)
+        df_result = pd.concat([df_result.drop(columns=new_block.columns, errors="ignore"), new_block], axis=1)
+
+    # 1. 排序：最近的日期在左边
+    df_result = sort_columns(df_result)
     
-    if not grouped_files:
-        print("⚠️ 没有需要处理的文件，脚本结束")
-    else:
-        for date_str, files in grouped_files.items():
-            df_result = process_date_group(date_str, files, df_result)
+    # 2. 保存结果
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    prepare_output(df_result).to_parquet(RESULT_STORE, compression="zstd", index=False)
+    print(f"🎉 累计结果已保存: {RESULT_STORE}")
 
-        # 1. 排序：最近的日期在左边
-        df_result = sort_columns(df_result)
+    # 只记录成功读取的文件，读取失败的文件下次运行会让该日期重新处理
+    for date, files in grouped_files.items():
+        manifest[date.strftime(DATE_LABEL_FORMAT)] = sorted(file_fingerprint(p) for p in files if p in parsed)
+    save_manifest(manifest)
+
+    # xlsx 只用于飞书下载链接，仅在推送时导出
+    if push_enabled:
+        export_excel(prepare_output(df_result), OUTPUT_FILE)
+        print(f"🎉 已导出表格: {OUTPUT_FILE}")
+
+    # 3. 生成详细摘要
+    date_cols = get_date_columns(df_result)
+    
+    if date_cols:
+        # 日期列为 Timestamp，最大值即最新的日期
+        latest_date = max(date_cols)
+        latest_label = latest_date.strftime(DATE_LABEL_FORMAT)
+        
+        # 筛选出最新这一天有数据的所有行：只扫描一次最新日期列，得到掩码后计数、求均值、取明细
+        values = df_result[latest_date].to_numpy(dtype=float, na_value=np.nan)
+        mask = ~np.isnan(values) & df_result['基金简称'].notna().to_numpy()
         
-        # 2. 保存结果
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        df_result.to_excel(OUTPUT_FILE, index=False)
-        print(f"🎉 累计结果已保存: {OUTPUT_FILE}")
-
-        # 3. 生成详细摘要
-        cols = df_result.columns.tolist()
-        date_cols = [c for c in cols if c not in ["基金代码", "基金简称"]]
+        count = int(mask.sum())
         
-        if date_cols:
-            # 因为我们已经 sort(reverse=True) 了，所以第0个就是最新的日期
-            latest_date = date_cols[0]
+        if count > 0:
+            day_rates = values[mask]
+            avg_rate = day_rates.mean()
             
-            # 筛选出最新这一天有数据的所有行
-            # .dropna() 自动过滤掉 NaN 的行
-            day_data = df_result[['基金简称', latest_date]].dropna()
+            # 构造标题
+            msg_title = f"📊 科创债ETF折算率 ({latest_label})"
             
-            count = len(day_data)
+            # 构造统计信息
+            msg_content = f"📈 参与质押ETF: {count} 家\n💰 平均折算率: {round(avg_rate, 2)}\n\n📋 当日明细:"
             
-            if count > 0:
-                avg_rate = day_data[latest_date].mean()
-                
-                # 构造标题
-                msg_title = f"📊 科创债ETF折算率 ({latest_date})"
-                
-                # 构造统计信息
-                msg_content = f"📈 参与质押ETF: {count} 家\n💰 平均折算率: {round(avg_rate, 2)}\n\n📋 当日明细:"
-                
-                # 循环罗列所有有数据的 ETF
-                for _, row in day_data.iterrows():
-                    name = row['基金简称']
-                    rate = int(row[latest_date]) # 转整数显示
-                    msg_content += f"\n• {name}: {rate}"
-            else:
-                msg_title = f"📊 科创债ETF折算率 ({latest_date})"
-                msg_content = "⚠️ 当日暂无匹配数据"
-
-            print(f"\n摘要信息:\n{msg_title}\n{msg_content}\n")
-
-            if push_enabled:
-                # 发送飞书
-                send_to_feishu("科创债ETF_累计结果.xlsx", msg_title, msg_content)
-                print("🚀 已执行飞书推送")
-            else:
-                print("✅ push_enabled=False → 跳过飞书推送")
\ No newline at end of file
+            # 罗列所有有数据的 ETF（折算率转整数显示）
+            names = df_result['基金简称'].to_numpy()[mask]
+            rates = day_rates.astype(np.int64)
+            msg_content += "\n" + "\n".join(f"• {n}: {r}" for n, r in zip(names, rates))
+        else:
+            msg_title = f"📊 科创债ETF折算率 ({latest_label})"
+            msg_content = "⚠️ 当日暂无匹配数据"
+
+        print(f"\n摘要信息:\n{msg_title}\n{msg_content}\n")
+
+        if push_enabled:
+            # 发送飞书
+            send_to_feishu("科创债ETF_累计结果.xlsx", msg_title, msg_content)
+            print("🚀 已执行飞书推送")
+        else:
+            print("✅ push_enabled=False → 跳过飞书推送")
\ No newline at end of file